@@ -1,3 +1,5 @@
+import os
+import json
 import streamlit as st
 import pandas as pd
 import plotly.express as px
@@ -10,65 +12,82 @@ st.set_page_config(layout="wide", page_title="NYC Congestion Audit 2025")
 st.title("2025 NYC Congestion Pricing Audit")
 
 # --- LOAD DATA ---
-@st.cache_data
+def read_output(name, **csv_kwargs):
+    """Loads a pipeline output as Arrow-backed columns, preferring the typed Parquet file over CSV"""
+    if os.path.exists(f"{name}.parquet"):
+        return pd.read_parquet(f"{name}.parquet", engine="pyarrow", dtype_backend="pyarrow")
+    return pd.read_csv(f"{name}.csv", engine="pyarrow", dtype_backend="pyarrow", **csv_kwargs)
+
+# Read-only reference data: cache by reference (no pickling on every hit)
+@st.cache_resource
 def load_data():
     try:
         # UPDATED: Read files directly from the current folder (no "outputs/" prefix)
-        leakage = pd.read_csv("leakage_audit.csv")
-        velocity = pd.read_csv("velocity_heatmap.csv")
-        weather = pd.read_csv("weather_elasticity.csv")
-        economics = pd.read_csv("economics.csv")
-        ghost = pd.read_csv("ghost_audit.csv")
+        leakage = read_output("leakage_audit", dtype={
+            "pickup_loc": "uint16[pyarrow]", "total_trips": "int64[pyarrow]",
+            "missing_surcharge_count": "int64[pyarrow]"
+        })
+        # Pre-pivoted by the pipeline: one row per weekday, one column per hour
+        velocity = read_output("velocity_heatmap", dtype={
+            "weekday": "uint8[pyarrow]"
+        }).set_index("weekday")
+        weather = read_output("weather_elasticity", parse_dates=["date"], dtype={
+            "precipitation_mm": "float32[pyarrow]", "trip_count": "int64[pyarrow]"
+        })
+        economics = read_output("economics", parse_dates=["month"], dtype={
+            "avg_surcharge": "float32[pyarrow]", "avg_tip_amt": "float32[pyarrow]"
+        })
+        ghost = read_output("ghost_audit", dtype={
+            "VendorID": "int8[pyarrow]"
+        })
+        with open("weather_corr.json") as f:
+            corr = json.load(f)["rain_elasticity"]
         
-        return leakage, velocity, weather, economics, ghost
+        return leakage, velocity, weather, economics, ghost, corr
     except FileNotFoundError:
-        return None, None, None, None, None
+        return None, None, None, None, None, None
 
-leakage_df, velocity_df, weather_df, economics_df, ghost_df = load_data()
+leakage_df, velocity_df, weather_df, economics_df, ghost_df, corr = load_data()
 
 if leakage_df is None:
     st.error("Data not found! Please run 'python pipeline.py' first.")
     st.stop()
 
-# --- TABS ---
-tab1, tab2, tab3, tab4 = st.tabs(["The Flow (Velocity)", "The Economics", "The Rain Tax", "Audit & Fraud"])
+# --- FIGURES ---
+# Keyed on the id of the cached DataFrame (stable across reruns); the leading
+# underscore tells Streamlit not to hash the frame itself
+@st.cache_resource
+def build_leakage_fig(df_id, _df):
+    fig = px.bar(_df, x="pickup_loc", y="missing_surcharge_count")
+    fig.update_xaxes(type="category") # Zone IDs are labels, not magnitudes
+    return fig
 
-# --- TAB 1: VELOCITY HEATMAP ---
-with tab1:
-    st.header("Did the toll speed up traffic?")
-    st.markdown("Average speed (MPH) inside the Congestion Zone by Day and Hour.")
-    
-    # Pivot data for heatmap
-    heatmap_data = velocity_df.pivot(index='weekday', columns='hour', values='avg_speed')
-    
-    fig = px.imshow(
-        heatmap_data, 
+@st.cache_resource
+def build_velocity_fig(df_id, _df):
+    return px.imshow(
+        _df, 
         labels=dict(x="Hour of Day", y="Day of Week", color="Speed (MPH)"),
         color_continuous_scale="RdYlGn", # Red = Slow, Green = Fast
         title="Congestion Velocity Heatmap"
     )
-    st.plotly_chart(fig, use_container_width=True)
 
-# --- TAB 2: ECONOMICS (TIPS vs SURCHARGE) ---
-with tab2:
-    st.header("Is it fair to drivers?")
-    st.markdown("Hypothesis: Higher tolls reduce the disposable income passengers leave for drivers.")
-    
+@st.cache_resource
+def build_economics_fig(df_id, _df):
     # Dual Axis Plot
     fig = go.Figure()
     
     # Bar: Surcharge
     fig.add_trace(go.Bar(
-        x=economics_df['month'], 
-        y=economics_df['avg_surcharge'], 
+        x=_df['month'], 
+        y=_df['avg_surcharge'], 
         name='Avg Surcharge ($)',
         marker_color='indianred'
     ))
     
     # Line: Tip Amount
     fig.add_trace(go.Scatter(
-        x=economics_df['month'], 
-        y=economics_df['avg_tip_amt'], 
+        x=_df['month'], 
+        y=_df['avg_tip_amt'], 
         name='Avg Tip ($)',
         yaxis='y2',
         line=dict(color='royalblue', width=4)
@@ -80,14 +99,42 @@ with tab2:
         yaxis2=dict(title="Avg Tip Received ($)", overlaying='y', side='right'),
         legend=dict(x=0.1, y=1.1, orientation="h")
     )
+    return fig
+
+@st.cache_resource
+def build_weather_fig(df_id, _df):
+    # OLS trendline fit runs once per process instead of every rerun
+    return px.scatter(
+        _df, 
+        x="precipitation_mm", 
+        y="trip_count", 
+        trendline="ols",
+        title="Correlation: Daily Rain vs. Trip Volume"
+    )
+
+# --- TABS ---
+tab1, tab2, tab3, tab4 = st.tabs(["The Flow (Velocity)", "The Economics", "The Rain Tax", "Audit & Fraud"])
+
+# --- TAB 1: VELOCITY HEATMAP ---
+with tab1:
+    st.header("Did the toll speed up traffic?")
+    st.markdown("Average speed (MPH) inside the Congestion Zone by Day and Hour.")
+    
+    fig = build_velocity_fig(id(velocity_df), velocity_df)
+    st.plotly_chart(fig, use_container_width=True)
+
+# --- TAB 2: ECONOMICS (TIPS vs SURCHARGE) ---
+with tab2:
+    st.header("Is it fair to drivers?")
+    st.markdown("Hypothesis: Higher tolls reduce the disposable income passengers leave for drivers.")
+    
+    fig = build_economics_fig(id(economics_df), economics_df)
     st.plotly_chart(fig, use_container_width=True)
 
 # --- TAB 3: WEATHER ELASTICITY ---
 with tab3:
     st.header("The Rain Tax")
     
-    corr = weather_df['trip_count'].corr(weather_df['precipitation_mm'])
-    
     col1, col2 = st.columns([1, 3])
     with col1:
         st.metric("Rain Elasticity Score", f"{corr:.4f}")
@@ -97,13 +144,7 @@ with tab3:
             st.warning("Elastic Demand: Rain significantly changes ridership.")
             
     with col2:
-        fig = px.scatter(
-            weather_df, 
-            x="precipitation_mm", 
-            y="trip_count", 
-            trendline="ols",
-            title="Correlation: Daily Rain vs. Trip Volume"
-        )
+        fig = build_weather_fig(id(weather_df), weather_df)
         st.plotly_chart(fig, use_container_width=True)
 
 # --- TAB 4: AUDIT & FRAUD ---
@@ -119,4 +160,5 @@ with tab4:
         st.subheader("Surcharge Leakage")
         st.markdown("Top Locations where trips end in the zone but pay **$0 surcharge**.")
 
-        st.bar_chart(leakage_df.set_index("pickup_loc")["missing_surcharge_count"])
+        fig = build_leakage_fig(id(leakage_df), leakage_df)
+        st.plotly_chart(fig, use_container_width=True)
@@ -1,25 +1,75 @@
 import os
+import shutil
 import requests
 import polars as pl
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 # --- CONFIGURATION ---
 DATA_DIR = "./data"
 BASE_URL = "https://d37ci6vzurychx.cloudfront.net/trip-data"
+MAX_WORKERS = 12
+CHUNK_SIZE = int(os.environ.get("DL_CHUNK", 8 << 20))  # 8 MiB copy buffer
+
+# Shared session: connection pooling + keep-alive across download threads
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=24, pool_maxsize=24))
 
 def download_file(url, local_path):
-    """Downloads a file if it doesn't already exist locally."""
-    if os.path.exists(local_path):
-        return True 
+    """Downloads a file, resuming a partial local copy via an HTTP Range request."""
+    local_size = os.path.getsize(local_path) if os.path.exists(local_path) else 0
     
-    print(f"⬇️ [Downloading] {url} ...")
     try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            with open(local_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=1024*1024): 
-                    f.write(chunk)
+        head = SESSION.head(url, allow_redirects=True)
+    except Exception as e:
+        # Offline: trust whatever is already on disk
+        if local_size:
             return True
+        print(f"❌ [Error] Failed to download {url}: {e}")
         return False
+    if head.status_code != 200:
+        return local_size > 0
+    
+    # Without a Content-Length we can't tell complete from partial: refetch
+    remote_size = int(head.headers.get("Content-Length", -1))
+    if local_size and local_size == remote_size:
+        return True 
+    
+    # If-Range: a republished file (new ETag) comes back as a full 200, not stale bytes
+    validator = head.headers.get("ETag") or head.headers.get("Last-Modified")
+    headers = {}
+    if 0 < local_size < remote_size and validator:
+        print(f"⏩ [Resuming] {url} from byte {local_size} ...")
+        headers = {"Range": f"bytes={local_size}-", "If-Range": validator}
+    else:
+        # Larger than remote (corrupt / other version) or not resumable: start over
+        print(f"⬇️ [Downloading] {url} ...")
+    try:
+        response = SESSION.get(url, headers=headers, stream=True)
+        if response.status_code not in (200, 206):
+            return False
+        
+        # 206 = server honoured the range, append; 200 = full body, rewrite
+        if response.status_code == 206:
+            mode = "ab"
+            total = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+        else:
+            mode = "wb"
+            total = response.headers.get("Content-Length", "")
+        # Content-Length is the encoded size when the body is compressed
+        if "Content-Encoding" in response.headers:
+            total = ""
+        expected = int(total) if total.isdigit() else -1
+        # Stream socket -> file directly (no Python-level chunk loop)
+        response.raw.decode_content = True
+        with open(local_path, mode) as f:
+            shutil.copyfileobj(response.raw, f, length=CHUNK_SIZE)
+        
+        final_size = os.path.getsize(local_path)
+        if expected >= 0 and final_size != expected:
+            print(f"❌ [Error] {url}: got {final_size} of {expected} bytes")
+            return False
+        return True
     except Exception as e:
         print(f"❌ [Error] Failed to download {url}: {e}")
         return False
@@ -29,52 +79,60 @@ def ingest_and_unify():
     yellow_files = []
     green_files = []
     
-    # 1. DOWNLOAD LOOP (Jan - Dec 2025)
+    # 1. DOWNLOAD (Jan - Dec 2025, in parallel)
     print("--- Phase 1: Automated Ingestion ---")
+    tasks = []
     for month in range(1, 13):
         month_str = f"{month:02d}"
-        
-        # Yellow Taxis
-        y_name = f"yellow_tripdata_2025-{month_str}.parquet"
-        if download_file(f"{BASE_URL}/{y_name}", f"{DATA_DIR}/{y_name}"):
-            yellow_files.append(f"{DATA_DIR}/{y_name}")
-            
-        # Green Taxis
-        g_name = f"green_tripdata_2025-{month_str}.parquet"
-        if download_file(f"{BASE_URL}/{g_name}", f"{DATA_DIR}/{g_name}"):
-            green_files.append(f"{DATA_DIR}/{g_name}")
-            
-        # Check for missing December (Constraint)
-        if month == 12 and not os.path.exists(f"{DATA_DIR}/{y_name}"):
-             print(f"⚠️ Dec 2025 missing. Imputation logic will be applied in pipeline.")
+        for color in ("yellow", "green"):
+            name = f"{color}_tripdata_2025-{month_str}.parquet"
+            tasks.append((f"{BASE_URL}/{name}", f"{DATA_DIR}/{name}"))
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        results = list(ex.map(lambda up: (up[1], download_file(*up)), tasks))
+
+    for path, ok in results:
+        if not ok:
+            continue
+        if "yellow_" in path:
+            yellow_files.append(path)
+        else:
+            green_files.append(path)
+
+    # Check for missing December (Constraint)
+    if not os.path.exists(f"{DATA_DIR}/yellow_tripdata_2025-12.parquet"):
+         print(f"⚠️ Dec 2025 missing. Imputation logic will be applied in pipeline.")
 
     # 2. SEPARATE SCANS & UNIFICATION
     # We scan yellow and green separately to avoid schema errors, then merge.
+    # Columns are downcast at scan time so downstream groupbys hash narrow types.
     
     # Process Yellow
-    q_yellow = pl.scan_parquet(yellow_files).select([
+    q_yellow = pl.scan_parquet(yellow_files, parallel="row_groups", low_memory=False).select([
         pl.col("tpep_pickup_datetime").alias("pickup_time"),
         pl.col("tpep_dropoff_datetime").alias("dropoff_time"),
-        pl.col("PULocationID").alias("pickup_loc"),
-        pl.col("DOLocationID").alias("dropoff_loc"),
-        pl.col("trip_distance"),
-        pl.col("fare_amount").alias("fare"),
-        pl.col("total_amount"),
-        pl.col("congestion_surcharge").fill_null(0.0),
-        pl.col("VendorID")
+        pl.col("PULocationID").cast(pl.UInt16).alias("pickup_loc"),
+        pl.col("DOLocationID").cast(pl.UInt16).alias("dropoff_loc"),
+        pl.col("trip_distance").cast(pl.Float32),
+        pl.col("fare_amount").cast(pl.Float32).alias("fare"),
+        pl.col("total_amount").cast(pl.Float32),
+        pl.col("tip_amount").cast(pl.Float32),
+        pl.col("congestion_surcharge").fill_null(0.0).cast(pl.Float32),
+        pl.col("VendorID").cast(pl.Int8)
     ])
 
     # Process Green
-    q_green = pl.scan_parquet(green_files).select([
+    q_green = pl.scan_parquet(green_files, parallel="row_groups", low_memory=False).select([
         pl.col("lpep_pickup_datetime").alias("pickup_time"),
         pl.col("lpep_dropoff_datetime").alias("dropoff_time"),
-        pl.col("PULocationID").alias("pickup_loc"),
-        pl.col("DOLocationID").alias("dropoff_loc"),
-        pl.col("trip_distance"),
-        pl.col("fare_amount").alias("fare"),
-        pl.col("total_amount"),
-        pl.col("congestion_surcharge").fill_null(0.0),
-        pl.col("VendorID")
+        pl.col("PULocationID").cast(pl.UInt16).alias("pickup_loc"),
+        pl.col("DOLocationID").cast(pl.UInt16).alias("dropoff_loc"),
+        pl.col("trip_distance").cast(pl.Float32),
+        pl.col("fare_amount").cast(pl.Float32).alias("fare"),
+        pl.col("total_amount").cast(pl.Float32),
+        pl.col("tip_amount").cast(pl.Float32),
+        pl.col("congestion_surcharge").fill_null(0.0).cast(pl.Float32),
+        pl.col("VendorID").cast(pl.Int8)
     ])
     
     # 3. CONCATENATE
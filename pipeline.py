@@ -1,13 +1,25 @@
+import os
+
+# Multi-file scan tuning (must be set before Polars is imported)
+_CPUS = os.cpu_count() or 1
+os.environ.setdefault("POLARS_NUM_READERS_PRE_INIT", str(_CPUS + 3))
+os.environ.setdefault("POLARS_MAX_CONCURRENT_SCANS", str(_CPUS))
+os.environ.setdefault("POLARS_IDEAL_MORSEL_SIZE", "250000")  # rows per streaming batch
+
+import json
+import numpy as np
 import polars as pl
 import openmeteo_requests
 import requests_cache
+import time
 from retry_requests import retry
 from datetime import datetime
 from ingest import ingest_and_unify # Import Phase 1 script
 
 OUTPUT_DIR = "./outputs"
-import os
 os.makedirs(OUTPUT_DIR, exist_ok=True)
+WEATHER_CACHE = f"{OUTPUT_DIR}/_weather_cache.parquet"
+DAILY_COUNTS_TMP = f"{OUTPUT_DIR}/_daily_counts.parquet"
 
 # Manhattan Zone IDs (South of 60th St)
 CONGESTION_ZONES = [
@@ -16,11 +28,25 @@ CONGESTION_ZONES = [
     170, 186, 209, 211, 224, 229, 230, 231, 232, 233, 234, 236, 237, 238, 239, 
     243, 244, 246, 249, 261, 262, 263
 ]
+# Typed once (matching the UInt16 location columns) so is_in doesn't rebuild
+# a set from a Python list per call
+ZONES = pl.Series("z", sorted(CONGESTION_ZONES), dtype=pl.UInt16)
+
+def in_zone(col):
+    """Congestion Zone membership for a location column"""
+    return pl.col(col).is_in(ZONES)
 
 def fetch_weather():
     """Fetches 2025 daily rain data for Central Park"""
+    # The 2025 archive is static: reuse today's parquet copy and skip the API
+    if os.path.exists(WEATHER_CACHE) and time.time() - os.path.getmtime(WEATHER_CACHE) < 86400:
+        print("☁️ Using Cached Weather Data...")
+        return pl.read_parquet(WEATHER_CACHE)
+
     print("☁️ Fetching Weather Data...")
-    cache_session = requests_cache.CachedSession('.cache', expire_after=3600)
+    cache_session = requests_cache.CachedSession(
+        '.cache', expire_after=requests_cache.NEVER_EXPIRE, cache_control=False
+    )
     retry_session = retry(cache_session, retries=5, backoff_factor=0.2)
     openmeteo = openmeteo_requests.Client(session=retry_session)
     
@@ -34,7 +60,7 @@ def fetch_weather():
     daily = responses[0].Daily()
     
     # FIX: Use datetime_range and explicitly cast to strict 'Date' type
-    return pl.DataFrame({
+    weather_df = pl.DataFrame({
         "date": pl.datetime_range(
             datetime(2025,1,1), 
             datetime(2025,12,31), 
@@ -43,44 +69,59 @@ def fetch_weather():
         ).cast(pl.Date),  # <--- This cast fixes the Join Error
         "precipitation_mm": daily.Variables(0).ValuesAsNumpy()
     })
+    weather_df.write_parquet(WEATHER_CACHE)
+    return weather_df
 
-def run_pipeline():
-    # 1. Ingest Data (LazyFrame)
-    q = ingest_and_unify()
+def engineer_features(q):
+    """Adds duration, calendar and speed columns to the unified trip frame"""
+    duration = (pl.col("dropoff_time") - pl.col("pickup_time")).dt.total_minutes()
     
-    # 2. Feature Engineering
-    q = q.with_columns([
-        (pl.col("dropoff_time") - pl.col("pickup_time")).dt.total_minutes().alias("duration_min"),
+    # Single fused pass; the clamped denominator avoids inf/NaN on zero-duration
+    # trips (those are flagged by the duration_min <= 0 ghost rule instead)
+    return q.with_columns([
+        duration.alias("duration_min"),
         pl.col("pickup_time").dt.date().alias("date"),
         pl.col("pickup_time").dt.hour().alias("hour"),
-        pl.col("pickup_time").dt.weekday().alias("weekday")
+        pl.col("pickup_time").dt.weekday().alias("weekday"),
+        (pl.col("trip_distance") * 60.0 / pl.max_horizontal(duration, pl.lit(1e-9)))
+            .cast(pl.Float32).alias("speed_mph")
     ])
+
+def run_pipeline():
+    # 1. Ingest Data (LazyFrame)
+    q = ingest_and_unify()
     
-    q = q.with_columns(
-        (pl.col("trip_distance") / (pl.col("duration_min") / 60)).alias("speed_mph")
-    )
+    # 2. Feature Engineering (once; every branch below derives from this plan)
+    q = engineer_features(q)
 
     # 3. The Ghost Trip Audit (Filter Dirty Data)
     print("👻 Auditing Ghost Trips...")
     ghost_criteria = (
         (pl.col("speed_mph") > 65) | 
+        (pl.col("duration_min") <= 0) |
         ((pl.col("duration_min") < 1) & (pl.col("fare") > 20)) |
         ((pl.col("trip_distance") == 0) & (pl.col("fare") > 0))
     )
     
-    # Save Ghost Stats separate from clean data
-    ghost_stats = q.filter(ghost_criteria).group_by("VendorID").len()
+    # Flag ghosts once so stats and clean branches share the same pass
+    q = q.with_columns(is_ghost=ghost_criteria)
+    
+    # Save Ghost Stats separate from clean data (single groupby, conditional count)
+    ghost_stats = q.group_by("VendorID").agg([
+        pl.col("is_ghost").sum().alias("ghost_count"),
+        pl.len().alias("total")
+    ])
     
     # Clean Data
-    q_clean = q.filter(~ghost_criteria)
+    q_clean = q.filter(~pl.col("is_ghost"))
 
     # 4. Aggregations (Reduce Data Size)
     
     # A. Leakage (Starts Outside -> Ends Inside -> No Surcharge)
     print("🔍 Calculating Leakage...")
     leakage_agg = q_clean.filter(
-        (~pl.col("pickup_loc").is_in(CONGESTION_ZONES)) & 
-        (pl.col("dropoff_loc").is_in(CONGESTION_ZONES))
+        (~in_zone("pickup_loc")) & 
+        (in_zone("dropoff_loc"))
     ).group_by("pickup_loc").agg([
         pl.len().alias("total_trips"),
         (pl.col("congestion_surcharge") == 0).sum().alias("missing_surcharge_count")
@@ -89,7 +130,7 @@ def run_pipeline():
     # B. Velocity Heatmap
     print("🚀 Calculating Velocity...")
     velocity_agg = q_clean.filter(
-        pl.col("pickup_loc").is_in(CONGESTION_ZONES)
+        in_zone("pickup_loc")
     ).group_by(["weekday", "hour"]).agg(
         pl.col("speed_mph").mean().alias("avg_speed")
     )
@@ -100,8 +141,7 @@ def run_pipeline():
         pl.col("date").dt.truncate("1mo").alias("month")
     ).group_by("month").agg([
         pl.col("congestion_surcharge").mean().alias("avg_surcharge"),
-        # Tip % calculation (Tip / Fare)
-        (pl.col("total_amount") - pl.col("fare")).mean().alias("avg_tip_amt") # Approx
+        pl.col("tip_amount").mean().alias("avg_tip_amt")
     ])
     
     # D. Daily Trip Counts (For Weather Join)
@@ -113,18 +153,52 @@ def run_pipeline():
     # 5. EXECUTE (Collect & Save)
     print("💾 Saving Aggregated Outputs (This may take a moment)...")
     
-    # Collect dataframes (executes the lazy plan)
-    ghost_stats.collect().write_csv(f"{OUTPUT_DIR}/ghost_audit.csv")
-    leakage_agg.collect().write_csv(f"{OUTPUT_DIR}/leakage_audit.csv")
-    velocity_agg.collect().write_csv(f"{OUTPUT_DIR}/velocity_heatmap.csv")
-    economics_agg.collect().write_csv(f"{OUTPUT_DIR}/economics.csv")
-    
-    # Weather Join (In Memory)
+    # Collect all branches together so the shared scan + feature engineering
+    # subplan runs once and is multiplexed to every aggregation (zone filters
+    # are applied per branch, after the shared part). Daily counts stream
+    # straight to a temp parquet for the lazy weather join below.
+    ghost_df, leakage_df, velocity_df, economics_df, _ = pl.collect_all(
+        [
+            ghost_stats, leakage_agg, velocity_agg, economics_agg,
+            daily_counts.sink_parquet(DAILY_COUNTS_TMP, lazy=True)
+        ],
+        engine="streaming"
+    )
+    ghost_df.write_parquet(f"{OUTPUT_DIR}/ghost_audit.parquet", compression="zstd", statistics=True)
+    leakage_df.write_parquet(f"{OUTPUT_DIR}/leakage_audit.parquet", compression="zstd", statistics=True)
+    # Store the heatmap already shaped (weekday x hour) so the dashboard only plots it
+    velocity_df = velocity_df.pivot(
+        index="weekday", on="hour", values="avg_speed", sort_columns=True
+    ).sort("weekday")
+    velocity_df.write_parquet(f"{OUTPUT_DIR}/velocity_heatmap.parquet", compression="zstd", statistics=True)
+    economics_df.write_parquet(f"{OUTPUT_DIR}/economics.parquet", compression="zstd", statistics=True)
+
+    # Weather Join (Streaming: scan the sunk counts, join lazily, sink)
     weather_df = fetch_weather()
-    trips_df = daily_counts.collect() # Collect trips before joining
     
-    # Inner join trips with weather
-    weather_df.join(trips_df, on="date", how="inner").write_csv(f"{OUTPUT_DIR}/weather_elasticity.csv")
+    # Inner join trips with weather. Missing Open-Meteo days arrive as NaN;
+    # store them as null so Arrow-backed readers see them as missing.
+    pl.scan_parquet(DAILY_COUNTS_TMP).join(
+        weather_df.lazy(), on="date", how="inner"
+    ).select([
+        "date", pl.col("precipitation_mm").fill_nan(None), "trip_count"
+    ]).sink_parquet(
+        f"{OUTPUT_DIR}/weather_elasticity.parquet", compression="zstd", statistics=True
+    )
+    os.remove(DAILY_COUNTS_TMP)
+    elasticity_df = pl.read_parquet(
+        f"{OUTPUT_DIR}/weather_elasticity.parquet", columns=["precipitation_mm", "trip_count"]
+    )
+
+    # Rain Elasticity Score (persisted so the dashboard doesn't recompute it)
+    # Only two columns for ~365 days, so reading them back is cheap
+    rain = elasticity_df["precipitation_mm"].to_numpy().astype(np.float32)
+    trips = elasticity_df["trip_count"].to_numpy().astype(np.float32)
+    # Drop days with missing rain data (pairwise, like pandas Series.corr)
+    valid = np.isfinite(rain) & np.isfinite(trips)
+    corr = np.corrcoef(rain[valid], trips[valid])[0, 1]
+    with open(f"{OUTPUT_DIR}/weather_corr.json", "w") as f:
+        json.dump({"rain_elasticity": float(corr)}, f)
     
     print("✅ Pipeline Complete.")
 